@@ -1,258 +1,210 @@
 import streamlit as st
 import pandas as pd
-import plotly.express as px
 import plotly.graph_objects as go
-import tempfile
+from plotly.colors import sample_colorscale
+from plotly.subplots import make_subplots
+import hashlib
+import heapq
+import json
+import multiprocessing
 import os
-import re
-import fitz  # PyMuPDF
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, BrokenExecutor, Future, ProcessPoolExecutor, wait
 from datetime import datetime, timedelta
 import base64
+from collections import OrderedDict, defaultdict
 from io import BytesIO
-from typing import Dict, List, Tuple, Optional
+from typing import List, Tuple, Optional
 import numpy as np
 
+import invoice_analyzer
+from invoice_analyzer import InvoiceAnalyzer, analyze_file, get_analyzer
+
+try:
+    import xlsxwriter
+except ImportError:  # repli sur openpyxl en mode write_only
+    xlsxwriter = None
+
 # ================================
-# PARTIE 1: ANALYSEUR DE FACTURES
+# PARTIE 1: EXÉCUTION DES ANALYSES
 # ================================
 
-class InvoiceAnalyzer:
-    """Analyseur intelligent de factures multi-fournisseurs"""
+def _available_cpus() -> int:
+    """Nombre de CPU réellement utilisables par le processus (affinité, conteneurs)"""
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0)) or 1
+    return os.cpu_count() or 1
+
+def _make_process_pool(file_count: int) -> Optional[Tuple[ProcessPoolExecutor, int]]:
+    """Pool de processus pour les gros lots, None pour une analyse dans le thread du script"""
+    # Processus seulement avec fork, méthode par défaut (Linux jusqu'à Python 3.13) : avec
+    # spawn/forkserver, chaque processus réexécuterait app.py, présenté par Streamlit comme
+    # __main__ sans __spec__. Et seulement à partir de quelques fichiers : en dessous, leur
+    # coût de démarrage l'emporte. Pas de threads : PyMuPDF n'est pas thread-safe et garde le GIL
+    if file_count >= 4 and multiprocessing.get_start_method() == 'fork':
+        max_workers = min(file_count, _available_cpus())
+        return ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('fork')), max_workers
+    return None
+
+def _iter_analyses(files: list, indices: List[int]):
+    """Analyse les fichiers indiqués et produit (indice, résultat, succès) au fil de l'eau"""
+    # Un échec inattendu (dont BrokenProcessPool) ne concerne que son fichier : il est
+    # rapporté comme erreur de lecture, sans succès pour ne pas être mis en cache
+    pool = _make_process_pool(len(indices))
+    if pool is None:
+        for i in indices:
+            try:
+                yield i, analyze_file(files[i].name, files[i].getvalue()), True
+            except Exception as e:
+                yield i, (files[i].name, None, None, str(e) or type(e).__name__), False
+        return
     
-    def __init__(self):
-        self.suppliers_patterns = {
-            'TERRE AZUR': {
-                'identifier': ['TERRE AZUR', 'TA BRETAGNE', 'terreazur.fr'],
-                'invoice_number': r'FACTURE\s+N°\s*(\d+)',
-                'date': r'du\s+(\d{2}\.\d{2}\.\d{4})',
-                'product_line': r'^\d+/\s+(\d+)\s+(.*?)\s+(\d+[,\.]\d+)\s+(PCH|KG|COL|SAC|PU|FLT|BQT)',
-                'total': r'Net à payer\s*:\s*([\d\s,\.]+)\s*EUR'
-            },
-            'METRO': {
-                'identifier': ['METRO', 'METRO France'],
-                'invoice_number': r'N°\s*FACTURE.*?(\d+/\d+)',
-                'date': r'Date facture\s*:\s*(\d{2}-\d{2}-\d{4})',
-                'product_line': r'(\d{11})\s+(\d+)\s+(.*?)\s+(\d+[,\.]\d+)\s+(S|I|M)',
-                'total': r'Total à payer\s*([\d\s,\.]+)'
-            },
-            'COLIN RHD': {
-                'identifier': ['Colin RHD', 'COLIN RHD SAS', 'colinrhd.com'],
-                'invoice_number': r'FACTURE\s+(\w+)',
-                'date': r'Date.*?(\d{2}/\d{2}/\d{4})',
-                'product_line': r'^(T\d+)\s+(\d+)\s+(CAR|UN)\s+(.*?)\s+([\d,\.]+)\s+([\d,\.]+)',
-                'total': r'NET À PAYER\s*:\s*\*+([\d,\.]+)'
-            },
-            'EPISAVEURS': {
-                'identifier': ['EpiSaveurs', 'EPISAVEURS', 'episaveurs'],
-                'invoice_number': r'FACTURE\s+N°\s*(\d+)',
-                'date': r'du\s+(\d{2}\.\d{2}\.\d{4})',
-                'product_line': r'^\d+/\s+(\d+)\s+(.*?)\s+(\d+[,\.]\d+)\s+(BID|PCH|COL|BTL|SAC)',
-                'total': r'Net à payer\s*:\s*([\d\s,\.]+)\s*EUR'
-            },
-            'PASSIONFROID': {
-                'identifier': ['PassionFroid', 'PASSIONFROID', 'passionfroid.fr'],
-                'invoice_number': r'FACTURE\s+N°\s*(\d+)',
-                'date': r'du\s+(\d{2}\.\d{2}\.\d{4})',
-                'product_line': r'^\d+/\s+(\d+)\s+(.*?)\s+(\d+[,\.]\d+)\s+(COL|PU|KG)',
-                'total': r'Net à payer\s*:\s*([\d\s,\.]+)\s*EUR'
-            },
-            'FOUGERES BOISSONS': {
-                'identifier': ['FOUGERES BOISSONS', 'OUEST BOISSONS'],
-                'invoice_number': r'FACTURE\s+(\w+-\d+)',
-                'date': r'du\s+(\d{2}/\d{2}/\d{4})',
-                'product_line': r'(\d{7})\s+(.*?)\s+(\d+)\s+(BTL|CAR|CAI|FAR)\s+([\d,\.]+)',
-                'total': r'Net facture\s*([\d\s,\.]+)\s*€'
-            },
-            'CAVE LES 3B': {
-                'identifier': ['CAVE LES 3B', 'sommeliers-cavistes'],
-                'invoice_number': r'N°(\w+)',
-                'date': r'Date document\s*:\s*(\d{2}/\d{2}/\d{4})',
-                'product_line': r'^([A-Z]+\d+)\s+(.*?)\s+([\d,\.]+)\s+([\d,\.]+)\s+([\d,\.]+)\s+(C\d+)',
-                'total': r'NET A PAYER\s*([\d\s,\.]+)\s*€'
-            }
-        }
-        
-    def extract_text_from_pdf(self, pdf_path: str) -> str:
-        """Extrait le texte d'un PDF avec PyMuPDF"""
-        try:
-            doc = fitz.open(pdf_path)
-            text = ""
-            for page in doc:
-                text += page.get_text()
-            doc.close()
-            return text
-        except Exception as e:
-            st.error(f"Erreur lors de la lecture du PDF {pdf_path}: {e}")
-            return ""
+    executor, max_workers = pool
+    with executor:
+        # Soumission par fenêtre : seuls les fichiers en cours d'analyse ont une copie de
+        # leur contenu en mémoire
+        queued = iter(indices)
+        futures = {}
+        while True:
+            for i in queued:
+                try:
+                    future = executor.submit(analyze_file, files[i].name, files[i].getvalue())
+                except BrokenExecutor as e:
+                    # Pool interrompu (processus tué) : échec rapporté comme celui d'une analyse
+                    future = Future()
+                    future.set_exception(e)
+                futures[future] = i
+                if len(futures) >= 2 * max_workers:
+                    break
+            if not futures:
+                break
+            
+            finished, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in finished:
+                i = futures.pop(future)
+                try:
+                    yield i, future.result(), True
+                except Exception as e:
+                    yield i, (files[i].name, None, None, str(e) or type(e).__name__), False
+
+def _analyzer_fingerprint() -> str:
+    """Empreinte du module d'analyse (patterns et parseurs) : toute modification invalide le cache disque"""
+    with open(invoice_analyzer.__file__, 'rb') as f:
+        return hashlib.blake2b(f.read(), digest_size=8).hexdigest()
+
+class AnalysisCache:
+    """Cache LRU des analyses, indexé par l'empreinte du contenu des PDFs"""
     
-    def identify_supplier(self, text: str) -> Optional[str]:
-        """Identifie le fournisseur à partir du texte"""
-        for supplier, patterns in self.suppliers_patterns.items():
-            for identifier in patterns['identifier']:
-                if identifier.lower() in text.lower():
-                    return supplier
-        return None
+    # Format des fichiers du cache disque, à incrémenter si la structure des résultats change
+    disk_format = 1
     
-    def parse_volume(self, description: str) -> Tuple[float, str]:
-        """Extrait le volume/contenance d'une description de produit"""
-        patterns = [
-            r'(\d+)[xX\*](\d+(?:[,\.]\d+)?)\s*([LlCcMm][Ll]?)',
-            r'(\d+(?:[,\.]\d+)?)\s*([LlCcMm][Ll])',
-            r'(\d+)[xX\*](\d+[,\.]\d+)\s*([LlCcMm][Ll]?)',
-            r'(\d+(?:[,\.]\d+)?)\s*(KG|kg|Kg)',
-            r'(\d+)\s*(CL|cl)',
-            r'(\d+)\s*P(?:\s|$)',
-        ]
-        
-        for pattern in patterns:
-            match = re.search(pattern, description)
-            if match:
-                groups = match.groups()
-                if len(groups) == 3:
-                    try:
-                        multiplier = float(groups[0].replace(',', '.'))
-                        volume = float(groups[1].replace(',', '.'))
-                        unit = groups[2].upper()
-                        
-                        if 'CL' in unit.upper():
-                            total_volume = multiplier * volume / 100
-                        elif 'ML' in unit.upper():
-                            total_volume = multiplier * volume / 1000
-                        else:
-                            total_volume = multiplier * volume
-                        
-                        return total_volume, 'L'
-                    except:
-                        pass
-                elif len(groups) == 2:
-                    try:
-                        volume = float(groups[0].replace(',', '.'))
-                        unit = groups[1].upper()
-                        
-                        if 'CL' in unit:
-                            return volume / 100, 'L'
-                        elif 'ML' in unit:
-                            return volume / 1000, 'L'
-                        elif 'KG' in unit:
-                            return volume, 'KG'
-                        else:
-                            return volume, unit
-                    except:
-                        pass
-        
-        return 0.0, ''
+    def __init__(self, max_entries: int = 256, directory: Optional[str] = None, version: str = '',
+                 max_disk_entries: int = 1024, max_age: float = 30 * 24 * 3600):
+        self.max_entries = max_entries
+        self.directory = directory
+        # Les fichiers écrits par un autre format ou un autre code d'analyse sont ignorés
+        self.version = f'{self.disk_format}-{version}'
+        self.max_disk_entries = max_disk_entries
+        self.max_age = max_age
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
     
-    def clean_product_name(self, product_name: str) -> str:
-        """Nettoie le nom du produit"""
-        product_name = re.sub(r'^\d+\s+', '', product_name)
-        product_name = re.sub(r'\d+[xX\*]\d+[,\.]?\d*\s*[LlCcMm][Ll]?', '', product_name)
-        product_name = re.sub(r'\d+[,\.]?\d*\s*[LlCcMm][Ll]', '', product_name)
-        product_name = re.sub(r'\d+[,\.]?\d*\s*KG', '', product_name, flags=re.IGNORECASE)
-        product_name = re.sub(r'\d+%', '', product_name)
-        product_name = re.sub(r'\d+P\s', '', product_name)
-        product_name = re.sub(r'\([^)]*\)', '', product_name)
-        product_name = ' '.join(product_name.split())
-        
-        return product_name.strip()
+    @staticmethod
+    def key(pdf_buffer) -> str:
+        """Empreinte BLAKE2b du contenu, calculée sur le tampon sans le copier"""
+        return hashlib.blake2b(pdf_buffer, digest_size=16).hexdigest()
     
-    def parse_invoice(self, text: str, supplier: str) -> Dict:
-        """Parse une facture selon le fournisseur"""
-        patterns = self.suppliers_patterns[supplier]
-        
-        invoice_data = {
-            'supplier': supplier,
-            'invoice_number': '',
-            'date': '',
-            'total_amount': 0.0,
-            'total_vat': 0.0,
-            'products': []
-        }
-        
-        # Numéro de facture
-        invoice_match = re.search(patterns['invoice_number'], text)
-        if invoice_match:
-            invoice_data['invoice_number'] = invoice_match.group(1)
-        
-        # Date
-        date_match = re.search(patterns['date'], text)
-        if date_match:
-            date_str = date_match.group(1)
-            for fmt in ['%d.%m.%Y', '%d-%m-%Y', '%d/%m/%Y']:
-                try:
-                    date_obj = datetime.strptime(date_str, fmt)
-                    invoice_data['date'] = date_obj.strftime('%Y-%m-%d')
-                    break
-                except:
-                    continue
-        
-        # Total
-        total_match = re.search(patterns['total'], text)
-        if total_match:
-            total_str = total_match.group(1).replace(' ', '').replace(',', '.')
-            try:
-                invoice_data['total_amount'] = float(total_str)
-            except:
-                pass
-        
-        # TVA
-        vat_patterns = [
-            r'TOTAL TVA\s*([\d\s,\.]+)',
-            r'Montant TVA\s*([\d\s,\.]+)',
-            r'TVA.*?:\s*([\d\s,\.]+)\s*€'
-        ]
-        for vat_pattern in vat_patterns:
-            vat_match = re.search(vat_pattern, text)
-            if vat_match:
-                vat_str = vat_match.group(1).replace(' ', '').replace(',', '.')
+    def get(self, key: str) -> Optional[Tuple]:
+        """Renvoie (fournisseur, facture, erreur) si ce contenu a déjà été analysé"""
+        with self._lock:
+            result = self._entries.get(key)
+            if result is not None:
+                self._entries.move_to_end(key)
+                return result
+        result = self._load(key) if self.directory else None
+        if result is not None:
+            self._remember(key, result)
+        return result
+    
+    def put(self, key: str, result: Tuple) -> None:
+        """Enregistre un résultat en mémoire et, pour une facture reconnue, sur disque"""
+        self._remember(key, result)
+        # Fournisseur non reconnu ou erreur : conservés en mémoire seulement, pour
+        # qu'une évolution des patterns les réanalyse au prochain démarrage
+        if self.directory and result[0] is not None:
+            self._store(key, result)
+    
+    def prune(self) -> None:
+        """Supprime du disque les résultats expirés, puis les plus anciens au-delà de max_disk_entries"""
+        if not self.directory:
+            return
+        files = []
+        try:
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith('.json'):
+                    files.append((entry.stat().st_mtime, entry.path))
+        except OSError:
+            return
+        files.sort(reverse=True)
+        expiry = time.time() - self.max_age
+        for position, (mtime, path) in enumerate(files):
+            if position >= self.max_disk_entries or mtime < expiry:
                 try:
-                    invoice_data['total_vat'] = float(vat_str)
-                    break
-                except:
+                    os.remove(path)
+                except OSError:
                     pass
-        
-        # Parsing des produits
-        lines = text.split('\n')
-        
-        for line in lines:
-            # Pattern générique pour essayer d'extraire des produits
-            product_patterns = [
-                # Pattern type Terre Azur
-                r'^\d+/\s+(\d+)\s+(.*?)\s+(\d+[,\.]\d+)\s+(PCH|KG|COL|SAC|PU|FLT|BQT)\s+.*?\s+([\d,\.]+)$',
-                # Pattern type Metro
-                r'^(\d{11})\s+(\d+)\s+(.*?)\s+([SI])\s+.*?\s+([\d,\.]+)',
-                # Pattern type Colin
-                r'^(T\d+)\s+(\d+)\s+(CAR|UN)\s+(.*?)\s+([\d,\.]+)\s+([\d,\.]+)',
-                # Pattern générique
-                r'^([A-Z0-9]+)\s+(.*?)\s+(\d+[,\.]\d+)\s+.*?\s+([\d,\.]+)'
-            ]
-            
-            for pattern in product_patterns:
-                match = re.match(pattern, line)
-                if match:
-                    groups = match.groups()
-                    try:
-                        product = {
-                            'code': groups[0] if len(groups) > 0 else '',
-                            'name': self.clean_product_name(groups[1] if len(groups) > 1 else groups[2] if len(groups) > 2 else ''),
-                            'quantity': float((groups[2] if len(groups) > 2 else '1').replace(',', '.')),
-                            'unit': groups[3] if len(groups) > 3 else 'UN',
-                            'price': float((groups[4] if len(groups) > 4 else groups[-1]).replace(',', '.')),
-                            'volume': 0.0,
-                            'volume_unit': ''
-                        }
-                        
-                        # Extraction du volume
-                        volume, unit = self.parse_volume(product['name'])
-                        product['volume'] = volume
-                        product['volume_unit'] = unit
-                        
-                        if product['name'] and product['price'] > 0:
-                            invoice_data['products'].append(product)
-                            break
-                    except:
-                        continue
-        
-        return invoice_data
+    
+    def _remember(self, key: str, result: Tuple) -> None:
+        """Ajoute un résultat en mémoire en évinçant les plus anciens au-delà de max_entries"""
+        with self._lock:
+            self._entries[key] = result
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+    
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f'{key}.json')
+    
+    def _load(self, key: str) -> Optional[Tuple]:
+        """Relit un résultat enregistré sur disque, None s'il est absent, illisible, expiré ou périmé"""
+        path = self._path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.max_age:
+                return None
+            with open(path, encoding='utf-8') as f:
+                entry = json.load(f)
+            if entry.get('version') != self.version:
+                return None
+            # Date de modification rafraîchie : l'éviction sur disque suit l'ordre d'utilisation
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return tuple(entry['result'])
+    
+    def _store(self, key: str, result: Tuple) -> None:
+        """Écrit un résultat sur disque ; ignoré si le disque n'est pas accessible en écriture"""
+        path = self._path(key)
+        # Fichier temporaire propre au processus et au thread, renommé une fois complet
+        tmp_path = f'{path}.{os.getpid()}-{threading.get_ident()}.tmp'
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'version': self.version, 'result': result}, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+@st.cache_resource
+def get_analysis_cache() -> AnalysisCache:
+    """Cache d'analyses partagé par toutes les sessions, conservé sur disque entre les redémarrages"""
+    analysis_cache = AnalysisCache(
+        directory=os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache'),
+        version=_analyzer_fingerprint()
+    )
+    analysis_cache.prune()
+    return analysis_cache
 
 # ================================
 # PARTIE 2: INTERFACE WEB
@@ -266,8 +218,8 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-# CSS personnalisé
-st.markdown("""
+# CSS personnalisé, en-tête et pied de page (HTML statique)
+PAGE_CSS = """
 <style>
     .stApp {
         background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
@@ -312,51 +264,196 @@ st.markdown("""
         box-shadow: 0 4px 15px 0 rgba(31, 38, 135, 0.1);
     }
 </style>
-""", unsafe_allow_html=True)
+"""
+
+HEADER_HTML = """
+<h1>📊 Analyseur de Factures Professionnel</h1>
+<p style='text-align: center; color: white; font-size: 1.2em; margin-bottom: 30px;'>
+    Uploadez vos factures PDF et obtenez une analyse détaillée instantanément
+</p>
+"""
+
+FOOTER_HTML = """
+<div style='text-align: center; color: white; padding: 20px;'>
+    <p>💡 Développé pour automatiser votre gestion de factures</p>
+</div>
+"""
+
+# Fournisseurs connus, collectés sous forme de codes puis convertis en catégorie
+SUPPLIER_DTYPE = pd.CategoricalDtype(list(InvoiceAnalyzer.suppliers_patterns))
+SUPPLIER_CODES = {supplier: code for code, supplier in enumerate(SUPPLIER_DTYPE.categories)}
+
+# Colonnes et types des tableaux de résultats : colonnes Arrow (pyarrow est installé
+# avec Streamlit), sauf le fournisseur qui reste catégoriel
+INVOICE_COLUMNS = ['Fichier', 'Fournisseur', 'N° Facture', 'Date', 'Total HT', 'TVA', 'Total TTC', 'Nb Produits']
+INVOICE_DTYPES = {
+    'Fichier': 'string[pyarrow]',
+    'Fournisseur': SUPPLIER_DTYPE,
+    'N° Facture': 'string[pyarrow]',
+    'Date': 'string[pyarrow]',
+    'Total HT': 'double[pyarrow]',
+    'TVA': 'double[pyarrow]',
+    'Total TTC': 'double[pyarrow]',
+    'Nb Produits': 'int32[pyarrow]'
+}
+PRODUCT_COLUMNS = ['Fournisseur', 'Date', 'N° Facture', 'Produit', 'Quantité', 'Volume', 'Prix Total']
+PRODUCT_DTYPES = {
+    'Fournisseur': SUPPLIER_DTYPE,
+    'Date': 'string[pyarrow]',
+    'N° Facture': 'string[pyarrow]',
+    'Produit': 'string[pyarrow]',
+    'Quantité': 'double[pyarrow]',
+    'Volume': 'double[pyarrow]',
+    'Prix Total': 'double[pyarrow]'
+}
+
+# Colonnes de l'analyse par fournisseur, cumulées pendant le dépouillement des résultats
+SUPPLIER_SUMMARY_COLUMNS = ['Nb Factures', 'Total HT', 'TVA', 'Total TTC', 'Nb Produits']
+
+# Colonnes du classement des produits, cumulées pendant le dépouillement des résultats
+PRODUCT_SUMMARY_COLUMNS = ['Quantité', 'Prix Total']
+
+# Classement des produits, partagé par le top 20 Excel et le top 10 graphique
+def summarize_products(product_totals):
+    """Calcule les 20 produits au montant total le plus élevé"""
+    top_products = heapq.nlargest(20, product_totals.items(), key=lambda item: item[1][1])
+    return pd.DataFrame.from_dict(
+        dict(top_products), orient='index', columns=PRODUCT_SUMMARY_COLUMNS
+    ).rename_axis('Produit')
+
+# Mise en page et configuration communes des graphiques (barre d'outils Plotly désactivée)
+CHART_LAYOUT = go.Layout(showlegend=False)
+CHART_CONFIG = {'displayModeBar': False}
+
+def _scale_colors(values, colorscale: str) -> List[str]:
+    """Couleurs discrètes des barres, échantillonnées sur l'échelle selon les valeurs"""
+    values = np.asarray(values, dtype=float)
+    if not len(values):
+        return []
+    span = np.ptp(values)
+    positions = (values - values.min()) / span if span else np.zeros(len(values))
+    return sample_colorscale(colorscale, positions)
+
+# Graphiques regroupés dans une seule figure (un seul rendu Plotly côté navigateur)
+def build_charts(supplier_data, top_products=None):
+    """Construit la figure des montants par fournisseur et du top 10 des produits"""
+    titles = ["Montant total par fournisseur"]
+    if top_products is not None:
+        titles.append("Top 10 des produits")
+    
+    fig = make_subplots(rows=1, cols=len(titles), subplot_titles=titles)
+    fig.add_trace(
+        go.Bar(
+            x=supplier_data['Fournisseur'],
+            y=supplier_data['Total TTC'],
+            name='Total TTC',
+            marker_color=_scale_colors(supplier_data['Total TTC'], 'Viridis')
+        ),
+        row=1, col=1
+    )
+    if top_products is not None:
+        fig.add_trace(
+            go.Bar(
+                x=top_products['Prix Total'],
+                y=top_products['Produit'],
+                orientation='h',
+                name='Prix Total',
+                marker_color=_scale_colors(top_products['Prix Total'], 'Reds')
+            ),
+            row=1, col=2
+        )
+    fig.update_layout(CHART_LAYOUT)
+    return fig
+
+def _iter_rows(df):
+    """Lignes d'un DataFrame en tuples, produites à la volée à partir de ses colonnes"""
+    # Une conversion par colonne plutôt que par cellule (itertuples), sensible sur les colonnes Arrow
+    return zip(*(df[column].tolist() for column in df.columns))
+
+# Écriture d'un onglet ligne par ligne : constant_memory n'accepte que des lignes croissantes
+def _write_sheet(workbook, sheet_name, df, header_format):
+    """Écrit un DataFrame dans un nouvel onglet"""
+    worksheet = workbook.add_worksheet(sheet_name)
+    worksheet.write_row(0, 0, df.columns, header_format)
+    for row_index, row in enumerate(_iter_rows(df), 1):
+        worksheet.write_row(row_index, 0, row)
+
+def _write_workbook_xlsxwriter(output, sheets):
+    """Écrit les onglets avec xlsxwriter (constant_memory)"""
+    workbook = xlsxwriter.Workbook(output, {
+        'constant_memory': True,
+        'strings_to_urls': False,
+        'strings_to_formulas': False,
+        'strings_to_numbers': False  # N° de facture ('000123') conservés en texte
+    })
+    header_format = workbook.add_format({'bold': True, 'border': 1, 'align': 'center'})
+    for sheet_name, df in sheets:
+        _write_sheet(workbook, sheet_name, df, header_format)
+    workbook.close()
+
+def _literal_cell(worksheet, value):
+    """Texte commençant par '=' forcé en chaîne (openpyxl en ferait une formule)"""
+    if isinstance(value, str) and value.startswith('='):
+        from openpyxl.cell import WriteOnlyCell
+        cell = WriteOnlyCell(worksheet, value=value)
+        cell.data_type = 's'
+        return cell
+    return value
+
+def _write_workbook_openpyxl(output, sheets):
+    """Écrit les onglets avec openpyxl en mode write_only (lignes en flux)"""
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Alignment, Border, Font, Side
+
+    workbook = Workbook(write_only=True)
+    thin = Side(style='thin')
+    header_font = Font(bold=True)
+    header_border = Border(left=thin, right=thin, top=thin, bottom=thin)
+    header_alignment = Alignment(horizontal='center')
+    for sheet_name, df in sheets:
+        worksheet = workbook.create_sheet(title=sheet_name)
+        header = []
+        for column in df.columns:
+            cell = WriteOnlyCell(worksheet, value=column)
+            cell.font = header_font
+            cell.border = header_border
+            cell.alignment = header_alignment
+            header.append(cell)
+        worksheet.append(header)
+        for row in _iter_rows(df):
+            worksheet.append([_literal_cell(worksheet, value) for value in row])
+    workbook.save(output)
 
 # Fonction pour créer le fichier Excel
-def create_excel_download(invoices, products):
+def create_excel_download(df_invoices, df_products, supplier_summary, product_summary):
     """Crée un fichier Excel téléchargeable"""
     output = BytesIO()
     
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        # Onglet 1: Résumé des factures
-        if invoices:
-            df_invoices = pd.DataFrame(invoices)
-            df_invoices.to_excel(writer, sheet_name='Résumé Factures', index=False)
-            
-            # Onglet 2: Détail des produits
-            if products:
-                df_products = pd.DataFrame(products)
-                df_products.to_excel(writer, sheet_name='Détail Produits', index=False)
-            
-            # Onglet 3: Analyse par fournisseur
-            supplier_summary = df_invoices.groupby('Fournisseur').agg({
-                'N° Facture': 'count',
-                'Total HT': 'sum',
-                'TVA': 'sum',
-                'Total TTC': 'sum'
-            }).rename(columns={'N° Facture': 'Nb Factures'})
-            supplier_summary.to_excel(writer, sheet_name='Analyse Fournisseurs')
-            
-            # Onglet 4: Top produits
-            if products:
-                df_products = pd.DataFrame(products)
-                product_summary = df_products.groupby('Produit').agg({
-                    'Quantité': 'sum',
-                    'Prix Total': 'sum'
-                }).sort_values('Prix Total', ascending=False).head(20)
-                product_summary.to_excel(writer, sheet_name='Top 20 Produits')
+    sheets = []
+    # Onglet 1: Résumé des factures
+    if not df_invoices.empty:
+        sheets.append(('Résumé Factures', df_invoices))
+        
+        # Onglet 2: Détail des produits
+        if not df_products.empty:
+            sheets.append(('Détail Produits', df_products))
+        
+        # Onglet 3: Analyse par fournisseur
+        sheets.append(('Analyse Fournisseurs', supplier_summary.reset_index()))
+        
+        # Onglet 4: Top produits
+        if not df_products.empty:
+            sheets.append(('Top 20 Produits', product_summary.reset_index()))
     
+    if xlsxwriter is not None:
+        _write_workbook_xlsxwriter(output, sheets)
+    else:
+        _write_workbook_openpyxl(output, sheets)
     return output.getvalue()
 
-# Header
-st.markdown("""
-<h1>📊 Analyseur de Factures Professionnel</h1>
-<p style='text-align: center; color: white; font-size: 1.2em; margin-bottom: 30px;'>
-    Uploadez vos factures PDF et obtenez une analyse détaillée instantanément
-</p>
-""", unsafe_allow_html=True)
+# CSS et header, envoyés en un seul élément à chaque rerun
+st.markdown(PAGE_CSS + HEADER_HTML, unsafe_allow_html=True)
 
 # Sidebar
 with st.sidebar:
@@ -394,12 +491,15 @@ with col1:
         help="Vous pouvez sélectionner plusieurs fichiers PDF"
     )
     
+    # Tailles lues une seule fois, réutilisées par la liste et les statistiques
+    file_sizes_kb = np.fromiter((f.size for f in uploaded_files or []), dtype=np.int64) / 1024
+    
     if uploaded_files:
         st.success(f"✅ {len(uploaded_files)} fichier(s) uploadé(s)")
         
         with st.expander("📁 Fichiers uploadés", expanded=True):
-            for i, file in enumerate(uploaded_files, 1):
-                st.text(f"{i}. {file.name} ({file.size / 1024:.1f} KB)")
+            for i, (file, size_kb) in enumerate(zip(uploaded_files, file_sizes_kb), 1):
+                st.text(f"{i}. {file.name} ({size_kb:.1f} KB)")
     
     st.markdown("</div>", unsafe_allow_html=True)
 
@@ -409,8 +509,7 @@ with col2:
     
     if uploaded_files:
         st.metric("Fichiers", len(uploaded_files), "PDF")
-        total_size = sum(f.size for f in uploaded_files) / 1024
-        st.metric("Taille totale", f"{total_size:.1f}", "KB")
+        st.metric("Taille totale", f"{file_sizes_kb.sum():.1f}", "KB")
     else:
         st.info("Uploadez des fichiers pour voir les stats")
     
@@ -422,69 +521,98 @@ if uploaded_files:
     
     if st.button("🚀 ANALYSER LES FACTURES", use_container_width=True):
         with st.spinner("🔄 Analyse en cours..."):
-            analyzer = InvoiceAnalyzer()
-            
             progress_bar = st.progress(0)
             status_text = st.empty()
             
-            all_invoices = []
-            all_products = []
+            # Résultats rangés par colonne (une liste par colonne du tableau final)
+            invoice_columns = {column: [] for column in INVOICE_COLUMNS}
+            product_columns = {column: [] for column in PRODUCT_COLUMNS}
+            supplier_totals = defaultdict(lambda: [0, 0.0, 0.0, 0.0, 0])
+            product_totals = defaultdict(lambda: [0.0, 0.0])
             
-            # Création d'un dossier temporaire
-            with tempfile.TemporaryDirectory() as temp_dir:
-                for i, uploaded_file in enumerate(uploaded_files):
-                    progress = (i + 1) / len(uploaded_files)
-                    progress_bar.progress(progress)
-                    status_text.text(f"Analyse de {uploaded_file.name}...")
+            # Les PDFs déjà analysés (même contenu) sont repris du cache
+            analysis_cache = get_analysis_cache()
+            keys = [AnalysisCache.key(uploaded_file.getbuffer()) for uploaded_file in uploaded_files]
+            results = [None] * len(uploaded_files)
+            pending = []
+            for i, key in enumerate(keys):
+                cached = analysis_cache.get(key)
+                if cached is None:
+                    pending.append(i)
+                else:
+                    results[i] = (uploaded_files[i].name,) + cached
+            done = len(uploaded_files) - len(pending)
+            
+            # Analyse des autres PDFs ; l'analyseur est construit dans le thread principal
+            # (hérité par les processus créés par fork)
+            if pending:
+                get_analyzer()
+                for i, result, succeeded in _iter_analyses(uploaded_files, pending):
+                    results[i] = result
+                    if succeeded:
+                        analysis_cache.put(keys[i], result[1:])
+                    done += 1
+                    progress_bar.progress(done / len(uploaded_files))
+                    status_text.text(f"Analyse de {uploaded_files[i].name} terminée ({done}/{len(uploaded_files)})")
+                analysis_cache.prune()
+            
+            for file_name, supplier, invoice_data, error in results:
+                if error:
+                    st.error(f"❌ Impossible de lire {file_name} : {error}")
+                elif not supplier:
+                    st.warning(f"⚠️ Fournisseur non reconnu dans {file_name}")
+                else:
+                    # Ajout aux résultats (une ligne par facture, une par produit)
+                    total_amount = invoice_data['total_amount']
+                    total_vat = invoice_data['total_vat']
+                    products = invoice_data['products']
+                    product_count = len(products)
+                    invoice_columns['Fichier'].append(file_name)
+                    supplier_code = SUPPLIER_CODES[supplier]
+                    invoice_columns['Fournisseur'].append(supplier_code)
+                    invoice_columns['N° Facture'].append(invoice_data['invoice_number'])
+                    invoice_columns['Date'].append(invoice_data['date'])
+                    invoice_columns['TVA'].append(total_vat)
+                    invoice_columns['Total TTC'].append(total_amount)
+                    invoice_columns['Nb Produits'].append(product_count)
                     
-                    # Sauvegarde du fichier
-                    file_path = os.path.join(temp_dir, uploaded_file.name)
-                    with open(file_path, "wb") as f:
-                        f.write(uploaded_file.getbuffer())
+                    totals = supplier_totals[supplier]
+                    totals[0] += 1
+                    totals[1] += total_amount - total_vat
+                    totals[2] += total_vat
+                    totals[3] += total_amount
+                    totals[4] += product_count
                     
-                    # Extraction et analyse
-                    text = analyzer.extract_text_from_pdf(file_path)
-                    if text:
-                        supplier = analyzer.identify_supplier(text)
-                        if supplier:
-                            invoice_data = analyzer.parse_invoice(text, supplier)
-                            
-                            # Ajout aux résultats
-                            all_invoices.append({
-                                'Fichier': uploaded_file.name,
-                                'Fournisseur': supplier,
-                                'N° Facture': invoice_data['invoice_number'],
-                                'Date': invoice_data['date'],
-                                'Total HT': invoice_data['total_amount'] - invoice_data['total_vat'],
-                                'TVA': invoice_data['total_vat'],
-                                'Total TTC': invoice_data['total_amount'],
-                                'Nb Produits': len(invoice_data['products'])
-                            })
-                            
-                            for product in invoice_data['products']:
-                                all_products.append({
-                                    'Fournisseur': supplier,
-                                    'Date': invoice_data['date'],
-                                    'N° Facture': invoice_data['invoice_number'],
-                                    'Produit': product['name'],
-                                    'Quantité': product['quantity'],
-                                    'Volume': product.get('volume', 0),
-                                    'Prix Total': product['price']
-                                })
-                        else:
-                            st.warning(f"⚠️ Fournisseur non reconnu dans {uploaded_file.name}")
-                    else:
-                        st.error(f"❌ Impossible de lire {uploaded_file.name}")
+                    product_columns['Fournisseur'].extend([supplier_code] * product_count)
+                    product_columns['Date'].extend([invoice_data['date']] * product_count)
+                    product_columns['N° Facture'].extend([invoice_data['invoice_number']] * product_count)
+                    product_columns['Produit'].extend([product['name'] for product in products])
+                    product_columns['Quantité'].extend([product['quantity'] for product in products])
+                    product_columns['Volume'].extend([product.get('volume', 0) for product in products])
+                    product_columns['Prix Total'].extend([product['price'] for product in products])
+                    for product in products:
+                        totals = product_totals[product['name']]
+                        totals[0] += product['quantity']
+                        totals[1] += product['price']
             
             progress_bar.progress(1.0)
             status_text.text("✅ Analyse terminée!")
             
             # Affichage des résultats
-            if all_invoices:
+            if invoice_columns['Fichier']:
                 st.markdown("---")
                 st.markdown("# 📈 Résultats de l'analyse")
                 
-                df_invoices = pd.DataFrame(all_invoices)
+                # Total HT calculé d'un bloc sur les colonnes TTC et TVA
+                invoice_columns['Total HT'] = np.subtract(invoice_columns['Total TTC'], invoice_columns['TVA'])
+                for columns in (invoice_columns, product_columns):
+                    columns['Fournisseur'] = pd.Categorical.from_codes(columns['Fournisseur'], dtype=SUPPLIER_DTYPE)
+                df_invoices = pd.DataFrame(invoice_columns, copy=False).astype(INVOICE_DTYPES)
+                df_products = pd.DataFrame(product_columns, copy=False).astype(PRODUCT_DTYPES)
+                product_summary = summarize_products(product_totals) if product_totals else None
+                supplier_summary = pd.DataFrame.from_dict(
+                    supplier_totals, orient='index', columns=SUPPLIER_SUMMARY_COLUMNS
+                ).rename_axis('Fournisseur')
                 
                 # Métriques
                 col1, col2, col3, col4 = st.columns(4)
@@ -495,53 +623,52 @@ if uploaded_files:
                 with col3:
                     st.metric("Total TTC", f"{df_invoices['Total TTC'].sum():,.2f} €")
                 with col4:
-                    st.metric("Produits", len(all_products))
+                    st.metric("Produits", len(df_products))
                 
                 # Graphiques
                 st.markdown("## 📊 Visualisations")
                 
-                tab1, tab2, tab3 = st.tabs(["Par fournisseur", "Top produits", "Données"])
+                tab1, tab2 = st.tabs(["Graphiques", "Données"])
                 
                 with tab1:
-                    supplier_data = df_invoices.groupby('Fournisseur')['Total TTC'].sum().reset_index()
-                    fig = px.bar(
-                        supplier_data, 
-                        x='Fournisseur', 
-                        y='Total TTC',
-                        title="Montant total par fournisseur",
-                        color='Total TTC',
-                        color_continuous_scale='Viridis'
+                    supplier_data = supplier_summary['Total TTC'].reset_index()
+                    top_products = None
+                    if product_summary is not None:
+                        top_products = product_summary['Prix Total'].head(10).reset_index()
+                    st.plotly_chart(
+                        build_charts(supplier_data, top_products),
+                        use_container_width=True,
+                        config=CHART_CONFIG
                     )
-                    st.plotly_chart(fig, use_container_width=True)
                 
                 with tab2:
-                    if all_products:
-                        df_products = pd.DataFrame(all_products)
-                        top_products = df_products.groupby('Produit')['Prix Total'].sum().nlargest(10).reset_index()
-                        fig2 = px.bar(
-                            top_products,
-                            x='Prix Total',
-                            y='Produit',
-                            orientation='h',
-                            title="Top 10 des produits",
-                            color='Prix Total',
-                            color_continuous_scale='Reds'
-                        )
-                        st.plotly_chart(fig2, use_container_width=True)
-                
-                with tab3:
+                    # Format appliqué côté navigateur : le DataFrame reste sérialisé en Arrow
+                    euro_column = st.column_config.NumberColumn(format="%.2f €")
+                    
                     st.subheader("📋 Tableau des factures")
-                    st.dataframe(df_invoices, use_container_width=True)
+                    st.dataframe(
+                        df_invoices,
+                        use_container_width=True,
+                        column_config={
+                            'Total HT': euro_column,
+                            'TVA': euro_column,
+                            'Total TTC': euro_column
+                        }
+                    )
                     
-                    if all_products:
+                    if not df_products.empty:
                         st.subheader("📦 Tableau des produits")
-                        st.dataframe(pd.DataFrame(all_products), use_container_width=True)
+                        st.dataframe(
+                            df_products,
+                            use_container_width=True,
+                            column_config={'Prix Total': euro_column}
+                        )
                 
                 # Téléchargement Excel
                 st.markdown("---")
                 st.markdown("## 💾 Télécharger le rapport Excel")
                 
-                excel_data = create_excel_download(all_invoices, all_products)
+                excel_data = create_excel_download(df_invoices, df_products, supplier_summary, product_summary)
                 
                 st.download_button(
                     label="📥 TÉLÉCHARGER LE FICHIER EXCEL",
@@ -557,8 +684,4 @@ if uploaded_files:
 
 # Footer
 st.markdown("---")
-st.markdown("""
-<div style='text-align: center; color: white; padding: 20px;'>
-    <p>💡 Développé pour automatiser votre gestion de factures</p>
-</div>
-""", unsafe_allow_html=True)
+st.markdown(FOOTER_HTML, unsafe_allow_html=True)
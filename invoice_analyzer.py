@@ -0,0 +1,375 @@
+"""Analyse des factures PDF : extraction du texte, identification du fournisseur et parsing.
+
+Module sans dépendance à Streamlit, importé par app.py et par les processus de
+travail (les tâches y sont sérialisées sous un nom de module stable).
+"""
+import re
+import fitz  # PyMuPDF
+from datetime import datetime
+from functools import lru_cache
+from typing import Dict, List, Tuple, Optional
+
+def _single_line(pattern: str) -> str:
+    """Adapte un motif de ligne au balayage MULTILINE : \\s ne franchit plus les retours à la ligne"""
+    return pattern.replace(r'\s', r'[^\S\n]')
+
+# Fragments retirés des noms de produits (rang, volumes, poids, pourcentages,
+# conditionnements, parenthèses), en une seule passe
+_CLEAN_RE = re.compile(
+    r'^\d+\s+'
+    r'|\d+[xX\*]\d+[,\.]?\d*\s*[LlCcMm][Ll]?'
+    r'|\d+[,\.]?\d*\s*[LlCcMm][Ll]'
+    r'|(?i:\d+[,\.]?\d*\s*KG)'
+    r'|\d+%'
+    r'|\d+P\s'
+    r'|\([^)]*\)'
+)
+
+# Formats de date, choisis d'après le séparateur (les motifs capturent jj?mm?aaaa)
+_DATE_FORMATS = {'.': '%d.%m.%Y', '-': '%d-%m-%Y', '/': '%d/%m/%Y'}
+
+# Libellés de TVA en une seule alternance, un groupe par libellé dans l'ordre de
+# priorité. Deux libellés ne peuvent pas commencer à la même position
+_VAT_RE = re.compile(
+    r'TOTAL TVA\s*([\d\s,\.]+)'
+    r'|Montant TVA\s*([\d\s,\.]+)'
+    r'|TVA.*?:\s*([\d\s,\.]+)\s*€'
+)
+
+# Volumes/contenances en une seule alternance, par ordre de priorité :
+# lot (6X75CL), volume (75CL, 1,5ML), poids (2,5KG)
+_VOLUME_RE = re.compile(
+    r'(?P<count>\d+)[xX\*](?P<pack_volume>\d+(?:[,\.]\d+)?)\s*(?P<pack_unit>[LlCcMm][Ll]?)'
+    r'|(?P<volume>\d+(?:[,\.]\d+)?)\s*(?P<unit>[LlCcMm][Ll])'
+    r'|(?P<weight>\d+(?:[,\.]\d+)?)\s*(?:KG|kg|Kg)'
+)
+
+# Nettoyage et volume sont des fonctions pures du libellé : mémorisées, car les
+# mêmes produits reviennent d'une facture à l'autre
+@lru_cache(maxsize=8192)
+def _clean_product_name(product_name: str) -> str:
+    """Nettoie le nom du produit"""
+    return ' '.join(_CLEAN_RE.sub('', product_name).split())
+
+@lru_cache(maxsize=8192)
+def _parse_volume(description: str) -> Tuple[float, str]:
+    """Extrait le volume/contenance d'une description de produit"""
+    # Un seul balayage : un lot l'emporte dès qu'il est trouvé, sinon la
+    # première correspondance de l'alternative la plus prioritaire
+    best = None
+    for match in _VOLUME_RE.finditer(description):
+        if match['pack_unit']:
+            total_volume = float(match['count']) * float(match['pack_volume'].replace(',', '.'))
+            unit = match['pack_unit'].upper()
+            if unit == 'CL':
+                return total_volume / 100, 'L'
+            if unit == 'ML':
+                return total_volume / 1000, 'L'
+            return total_volume, 'L'
+        if best is None or match.lastindex < best.lastindex:
+            best = match
+    
+    if best is None:
+        return 0.0, ''
+    if best['weight']:
+        return float(best['weight'].replace(',', '.')), 'KG'
+    volume = float(best['volume'].replace(',', '.'))
+    unit = best['unit'].upper()
+    if unit == 'CL':
+        return volume / 100, 'L'
+    if unit == 'ML':
+        return volume / 1000, 'L'
+    return volume, unit
+
+_NUMBER_RE = re.compile(r'-?(?:\d+\.?\d*|\.\d+)', re.ASCII)
+
+def _to_float(value: str) -> Optional[float]:
+    """Convertit un montant extrait ('1 234,56') en float, None s'il n'est pas numérique"""
+    value = value.strip().replace(' ', '').replace(',', '.')
+    if _NUMBER_RE.fullmatch(value):
+        return float(value)
+    return None
+
+def _field_float(value: str) -> Optional[float]:
+    """Convertit un champ numérique de ligne produit (chiffres, virgule, point) en float"""
+    # Le motif de ligne garantit déjà l'alphabet : float() suffit, sans validation regex
+    try:
+        return float(value.replace(',', '.'))
+    except ValueError:
+        return None
+
+def _compile_supplier_patterns(suppliers_patterns: Dict[str, Dict]) -> Dict[str, Dict]:
+    """Compile les patterns de chaque fournisseur (les lignes produits sont bornées à une ligne)"""
+    compiled = {}
+    for supplier, patterns in suppliers_patterns.items():
+        compiled[supplier] = {
+            **patterns,
+            'invoice_number': re.compile(patterns['invoice_number'], re.MULTILINE),
+            'date': re.compile(patterns['date'], re.MULTILINE),
+            'product_line': re.compile(_single_line(patterns['product_line']), re.MULTILINE),
+            'total': re.compile(patterns['total'], re.MULTILINE)
+        }
+    return compiled
+
+class InvoiceAnalyzer:
+    """Analyseur intelligent de factures multi-fournisseurs"""
+    
+    # Patterns compilés une seule fois par processus, partagés par toutes les instances
+    suppliers_patterns = _compile_supplier_patterns({
+        'TERRE AZUR': {
+            'identifier': ['TERRE AZUR', 'TA BRETAGNE', 'terreazur.fr'],
+            'invoice_number': r'FACTURE\s+N°\s*(\d+)',
+            'date': r'du\s+(\d{2}\.\d{2}\.\d{4})',
+            'product_line': r'^\d+/\s+(\d+)\s+(.*?)\s+(\d+[,\.]\d+)\s+(PCH|KG|COL|SAC|PU|FLT|BQT)\s+.*?\s+([\d,\.]+)$',
+            'product_fields': {'code': 1, 'name': 2, 'quantity': 3, 'unit': 4, 'price': 5},
+            'total': r'Net à payer\s*:\s*([\d\s,\.]+)\s*EUR'
+        },
+        'METRO': {
+            'identifier': ['METRO', 'METRO France'],
+            'invoice_number': r'N°\s*FACTURE.*?(\d+/\d+)',
+            'date': r'Date facture\s*:\s*(\d{2}-\d{2}-\d{4})',
+            'product_line': r'^(\d{11})\s+(\d+)\s+(.*?)\s+(\d+[,\.]\d+)\s+(S|I|M)',
+            'product_fields': {'code': 1, 'name': 3, 'quantity': 2, 'price': 4},
+            'total': r'Total à payer\s*([\d\s,\.]+)'
+        },
+        'COLIN RHD': {
+            'identifier': ['Colin RHD', 'COLIN RHD SAS', 'colinrhd.com'],
+            'invoice_number': r'FACTURE\s+(\w+)',
+            'date': r'Date.*?(\d{2}/\d{2}/\d{4})',
+            'product_line': r'^(T\d+)\s+(\d+)\s+(CAR|UN)\s+(.*?)\s+([\d,\.]+)\s+([\d,\.]+)',
+            'product_fields': {'code': 1, 'name': 4, 'quantity': 2, 'unit': 3, 'price': 6},
+            'total': r'NET À PAYER\s*:\s*\*+([\d,\.]+)'
+        },
+        'EPISAVEURS': {
+            'identifier': ['EpiSaveurs', 'EPISAVEURS', 'episaveurs'],
+            'invoice_number': r'FACTURE\s+N°\s*(\d+)',
+            'date': r'du\s+(\d{2}\.\d{2}\.\d{4})',
+            'product_line': r'^\d+/\s+(\d+)\s+(.*?)\s+(\d+[,\.]\d+)\s+(BID|PCH|COL|BTL|SAC)\s+.*?\s+([\d,\.]+)$',
+            'product_fields': {'code': 1, 'name': 2, 'quantity': 3, 'unit': 4, 'price': 5},
+            'total': r'Net à payer\s*:\s*([\d\s,\.]+)\s*EUR'
+        },
+        'PASSIONFROID': {
+            'identifier': ['PassionFroid', 'PASSIONFROID', 'passionfroid.fr'],
+            'invoice_number': r'FACTURE\s+N°\s*(\d+)',
+            'date': r'du\s+(\d{2}\.\d{2}\.\d{4})',
+            'product_line': r'^\d+/\s+(\d+)\s+(.*?)\s+(\d+[,\.]\d+)\s+(COL|PU|KG)\s+.*?\s+([\d,\.]+)$',
+            'product_fields': {'code': 1, 'name': 2, 'quantity': 3, 'unit': 4, 'price': 5},
+            'total': r'Net à payer\s*:\s*([\d\s,\.]+)\s*EUR'
+        },
+        'FOUGERES BOISSONS': {
+            'identifier': ['FOUGERES BOISSONS', 'OUEST BOISSONS'],
+            'invoice_number': r'FACTURE\s+(\w+-\d+)',
+            'date': r'du\s+(\d{2}/\d{2}/\d{4})',
+            'product_line': r'^(\d{7})\s+(.*?)\s+(\d+)\s+(BTL|CAR|CAI|FAR)\s+([\d,\.]+)',
+            'product_fields': {'code': 1, 'name': 2, 'quantity': 3, 'unit': 4, 'price': 5},
+            'total': r'Net facture\s*([\d\s,\.]+)\s*€'
+        },
+        'CAVE LES 3B': {
+            'identifier': ['CAVE LES 3B', 'sommeliers-cavistes'],
+            'invoice_number': r'N°(\w+)',
+            'date': r'Date document\s*:\s*(\d{2}/\d{2}/\d{4})',
+            'product_line': r'^([A-Z]+\d+)\s+(.*?)\s+([\d,\.]+)\s+([\d,\.]+)\s+([\d,\.]+)\s+(C\d+)',
+            'product_fields': {'code': 1, 'name': 2, 'quantity': 3, 'price': 5},
+            'total': r'NET A PAYER\s*([\d\s,\.]+)\s*€'
+        }
+    })
+    
+    # Identifiants de tous les fournisseurs en une seule alternance : un groupe par
+    # fournisseur, dans l'ordre de priorité de suppliers_patterns. Les identifiants
+    # sont en minuscules et cherchés dans le texte abaissé une fois par page,
+    # plus rapide qu'un balayage IGNORECASE
+    _supplier_names = list(suppliers_patterns)
+    _supplier_re = re.compile(
+        '|'.join(
+            '(' + '|'.join(dict.fromkeys(re.escape(identifier.lower()) for identifier in patterns['identifier'])) + ')'
+            for patterns in suppliers_patterns.values()
+        )
+    )
+    
+    def __init__(self):
+        # Parseur de lignes produits spécialisé par fournisseur
+        self._product_parsers = {
+            supplier: self._make_product_parser(patterns['product_line'], patterns['product_fields'])
+            for supplier, patterns in self.suppliers_patterns.items()
+        }
+        
+    def _make_product_parser(self, product_re: re.Pattern, fields: Dict[str, int]):
+        """Construit le parseur des lignes produits d'un fournisseur"""
+        code_group = fields['code']
+        name_group = fields['name']
+        quantity_group = fields['quantity']
+        unit_group = fields.get('unit')
+        price_group = fields['price']
+        
+        def parse_products(text: str) -> List[Dict]:
+            products = []
+            for match in product_re.finditer(text):
+                quantity = _field_float(match.group(quantity_group))
+                price = _field_float(match.group(price_group))
+                if quantity is None or price is None or price <= 0:
+                    continue
+                
+                # Libellé brut : nettoyage et volume sont calculés en lot dans parse_invoice
+                products.append({
+                    'code': match.group(code_group),
+                    'name': match.group(name_group),
+                    'quantity': quantity,
+                    'unit': match.group(unit_group) if unit_group else 'UN',
+                    'price': price,
+                    'volume': 0.0,
+                    'volume_unit': ''
+                })
+            return products
+        
+        return parse_products
+    
+    def extract_text_from_pdf(self, pdf_bytes: bytes) -> List[str]:
+        """Extrait le texte d'un PDF en mémoire avec PyMuPDF (une chaîne par page)"""
+        # Ordre de lecture natif (sort=False) : les motifs travaillent ligne à ligne
+        with fitz.open(stream=pdf_bytes, filetype='pdf') as doc:
+            return [page.get_text('text', sort=False) for page in doc]
+    
+    def identify_supplier(self, pages: List[str]) -> Optional[str]:
+        """Identifie le fournisseur à partir du texte des pages"""
+        # Un seul balayage : on retient le fournisseur prioritaire parmi ceux trouvés
+        best_rank = None
+        for page in pages:
+            for match in self._supplier_re.finditer(page.lower()):
+                rank = match.lastindex - 1
+                if best_rank is None or rank < best_rank:
+                    best_rank = rank
+                    if rank == 0:
+                        return self._supplier_names[0]
+        return self._supplier_names[best_rank] if best_rank is not None else None
+    
+    def parse_volume(self, description: str) -> Tuple[float, str]:
+        """Extrait le volume/contenance d'une description de produit"""
+        return _parse_volume(description)
+    
+    def clean_product_name(self, product_name: str) -> str:
+        """Nettoie le nom du produit"""
+        return _clean_product_name(product_name)
+    
+    def _search_pages(self, pattern: re.Pattern, pages: List[str]) -> Optional[re.Match]:
+        """Cherche un motif page par page et renvoie la première correspondance"""
+        for page in pages:
+            match = pattern.search(page)
+            if match:
+                return match
+        return None
+    
+    def _search_vat(self, pages: List[str]) -> Optional[float]:
+        """Cherche la TVA : libellé le plus prioritaire dont le montant est numérique"""
+        # Première occurrence de chaque libellé, page par page. La recherche repart
+        # juste après le début de chaque correspondance pour n'en masquer aucune
+        first_matches = {}
+        for page in pages:
+            pos = 0
+            while len(first_matches) < 3:
+                match = _VAT_RE.search(page, pos)
+                if match is None:
+                    break
+                rank = match.lastindex
+                if rank not in first_matches:
+                    first_matches[rank] = match
+                    if rank == 1:
+                        total_vat = _to_float(match.group(1))
+                        if total_vat is not None:
+                            return total_vat
+                pos = match.start() + 1
+        
+        for rank in sorted(first_matches):
+            total_vat = _to_float(first_matches[rank].group(rank))
+            if total_vat is not None:
+                return total_vat
+        return None
+    
+    def parse_invoice(self, pages: List[str], supplier: str) -> Dict:
+        """Parse une facture selon le fournisseur"""
+        patterns = self.suppliers_patterns[supplier]
+        
+        # En-tête (numéro, date) sur la première page, sinon la dernière ;
+        # totaux et TVA sur les deux dernières pages
+        header_pages = pages[:1] + pages[-1:] if len(pages) > 1 else pages
+        footer_pages = pages[-2:][::-1]
+        
+        invoice_data = {
+            'supplier': supplier,
+            'invoice_number': '',
+            'date': '',
+            'total_amount': 0.0,
+            'total_vat': 0.0,
+            'products': []
+        }
+        
+        # Numéro de facture
+        invoice_match = self._search_pages(patterns['invoice_number'], header_pages)
+        if invoice_match:
+            invoice_data['invoice_number'] = invoice_match.group(1)
+        
+        # Date
+        date_match = self._search_pages(patterns['date'], header_pages)
+        if date_match:
+            date_str = date_match.group(1)
+            fmt = _DATE_FORMATS.get(date_str[2:3])
+            if fmt:
+                try:
+                    date_obj = datetime.strptime(date_str, fmt)
+                    invoice_data['date'] = date_obj.strftime('%Y-%m-%d')
+                except ValueError:
+                    pass
+        
+        # Total
+        total_match = self._search_pages(patterns['total'], footer_pages)
+        if total_match:
+            total_amount = _to_float(total_match.group(1))
+            if total_amount is not None:
+                invoice_data['total_amount'] = total_amount
+        
+        # TVA
+        total_vat = self._search_vat(footer_pages)
+        if total_vat is not None:
+            invoice_data['total_vat'] = total_vat
+        
+        # Parsing des produits : un seul balayage du texte de toutes les pages
+        # (les motifs de ligne ne franchissent pas les retours à la ligne)
+        products = self._product_parsers[supplier]('\n'.join(pages))
+        
+        # Nettoyage et extraction du volume une seule fois par libellé distinct
+        names = {raw: self.clean_product_name(raw) for raw in {product['name'] for product in products}}
+        volumes = {name: self.parse_volume(name) for name in set(names.values()) if name}
+        for product in products:
+            product['name'] = names[product['name']]
+            if product['name']:
+                product['volume'], product['volume_unit'] = volumes[product['name']]
+                invoice_data['products'].append(product)
+        
+        return invoice_data
+
+# Erreurs de lecture PyMuPDF : FileDataError (dérivée de RuntimeError), exceptions MuPDF
+# (FzErrorBase, hors RuntimeError) des versions récentes, ValueError pour un PDF chiffré
+PDF_READ_ERRORS = (RuntimeError, ValueError)
+if hasattr(fitz, 'mupdf'):
+    PDF_READ_ERRORS += (fitz.mupdf.FzErrorBase,)
+
+@lru_cache(maxsize=None)
+def get_analyzer() -> InvoiceAnalyzer:
+    """Instance partagée de l'analyseur, construite une fois par processus"""
+    return InvoiceAnalyzer()
+
+def analyze_file(file_name: str, pdf_bytes: bytes) -> Tuple[str, Optional[str], Optional[Dict], Optional[str]]:
+    """Analyse un PDF dans un processus de travail ou le thread du script : (fichier, fournisseur, facture, erreur)"""
+    # Instance du processus courant (construite au premier appel) plutôt que
+    # sérialisée avec chaque tâche
+    analyzer = get_analyzer()
+    try:
+        pages = analyzer.extract_text_from_pdf(pdf_bytes)
+    except PDF_READ_ERRORS as e:
+        return file_name, None, None, str(e)
+    if not any(pages):
+        return file_name, None, None, "aucun texte extrait"
+    
+    supplier = analyzer.identify_supplier(pages)
+    if not supplier:
+        return file_name, None, None, None
+    return file_name, supplier, analyzer.parse_invoice(pages, supplier), None